@@ -0,0 +1,30 @@
+"""
+This file defines helpers shared by the scraper, the LLM generation, and main.py for
+reading and writing word count datasets, so each format is handled in one place.
+"""
+
+# Imports
+from collections import Counter
+import csv
+
+def write_word_counts(counts: Counter, filename: str):
+    """
+    Helper function that writes counts to a csv with the name filename, one word,count row per word.
+    """
+
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        for word, count in counts.items():
+            writer.writerow([word, count])
+
+def dataset_to_counter(file_path: str):
+    """
+    Helper function to convert a csv with one word,count row per word into a Counter.
+    """
+
+    counts = Counter()
+    with open(file_path, 'r', newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        for word, count in reader:
+            counts[word] = int(count)
+    return counts
@@ -10,14 +10,32 @@ Credits: ChatGPT was used for planning and writing elements of the code in this
 
 # Imports
 from collections import Counter
+from common import write_word_counts
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import env
 import google.generativeai as genai
 import os
 import re
+import threading
+import time
 
 # Same as REMOVE_EXTRA_CHARS_RE except this doesn't include \n since \n needs to be handled specially
-REMOVE_EXTRA_CHARS_RE_2 = r'[\[\]\r\t?".,\/#!$%^&*;:{}=_`~()\[\]-]+'
+REMOVE_EXTRA_CHARS_RE_2 = re.compile(r'[\[\]\r\t?".,\/#!$%^&*;:{}=_`~()\[\]-]+')
+
+# "/" and "\n" separate words, so they are turned into spaces rather than removed
+SEPARATOR_CHARS_TABLE = str.maketrans({"/": " ", "\n": " "})
+
+# Number of gemini requests allowed to run concurrently
+MAX_LLM_WORKERS = 16
+# Gemini-pro's per-minute request quota, requests are spaced out so that it is never exceeded
+MAX_LLM_REQUESTS_PER_MINUTE = 60
+# Number of times a failed request is retried (with exponential backoff) before giving up
+MAX_LLM_RETRIES = 3
+
+# Shared across worker threads to space out requests
+rate_limit_lock = threading.Lock()
+next_request_time = 0.0
 
 genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 model = genai.GenerativeModel('gemini-pro')
@@ -35,40 +53,62 @@ def read_from_csv(csv_path: str):
             data.append(row)
     return data
 
+def wait_for_rate_limit():
+    """
+    Helper function that blocks until another request can be sent without going over
+    MAX_LLM_REQUESTS_PER_MINUTE, reserving that request's slot.
+    """
+
+    global next_request_time
+    with rate_limit_lock:
+        now = time.monotonic()
+        wait = max(0.0, next_request_time - now)
+        next_request_time = max(now, next_request_time) + 60 / MAX_LLM_REQUESTS_PER_MINUTE
+    time.sleep(wait)
+
 def generate_llm_response(game_title: str, formatted_topic: list):
     """
     Helper function that takes in a topic in the format [title, content] and will generate
     a response from gemini and a game_title.
     """
 
+    print("Processing new topic.")
+
     # Note that the llm is encouraged to act more anonmyously to generate a response
     # meant to mimic a generic user on the thread
     llm_text_input = "You are a player (do not act like a dev, that is dishonest and unhelpful) on a forum discussing " + game_title + ". Reply to a post with the title [" + formatted_topic[0] + "] with content [" + formatted_topic[1] + "]"
-    response = model.generate_content(llm_text_input)
 
-    # Necessary try/except since response can fail to return and accessing it will cause a crash
-    try:
-        return response.text
-    except:
-        return ""
+    for attempt in range(MAX_LLM_RETRIES + 1):
+        wait_for_rate_limit()
+        # Necessary try/except since the request can fail (e.g. when over quota) and the response
+        # can fail to return and accessing it will cause a crash
+        try:
+            response = model.generate_content(llm_text_input)
+        except:
+            if attempt < MAX_LLM_RETRIES:
+                time.sleep(2 ** attempt)
+            continue
+        try:
+            return response.text
+        except:
+            return ""
+    print("Gave up on topic after " + str(MAX_LLM_RETRIES + 1) + " failed requests.")
+    return ""
 
 def generate_llm_dataset(responses: list, filename: str):
     """
     Helper function that takes a list of LLM generated responses and converts it into a csv
-    file of words with the name filename.
+    file of word counts with the name filename.
     """
 
-    total_contents = []
+    total_counts = Counter()
     
-    # Takes each response and breaks it into the individual words, making total_contents a list of words
-    words = [response.split() for response in responses]
-    for sublist in words:
-        total_contents += sublist
+    # Takes each response and breaks it into the individual words, counting each word across all responses
+    for response in responses:
+        total_counts.update(response.split())
     
-    # Write the list of LLM response contents to the CSV file
-    with open(filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(total_contents)
+    # Write the count of each word in the LLM responses to the CSV file, one word per row
+    write_word_counts(total_counts, filename)
 
 def generate_all_responses(game_title: str, old_csv_path: str, new_csv_path: str):
     """
@@ -78,16 +118,16 @@ def generate_all_responses(game_title: str, old_csv_path: str, new_csv_path: str
 
     print("Starting LLM Generation")
     topics = read_from_csv(old_csv_path)
-    all_responses = []
-    for topic in topics:
-        print("Processing new topic.")
-        all_responses.append(generate_llm_response(game_title, topic))
+
+    # Each request is a blocking round-trip to the api, so they are sent concurrently.
+    # The number of workers caps how many requests are in flight at once, and
+    # wait_for_rate_limit caps how many are sent per minute.
+    with ThreadPoolExecutor(max_workers=MAX_LLM_WORKERS) as executor:
+        all_responses = list(executor.map(lambda topic: generate_llm_response(game_title, topic), topics))
     
-    cleaned_responses = [re.sub(REMOVE_EXTRA_CHARS_RE_2, '', content.replace("/", " ")).replace("\n", " ").strip().lower() for content in all_responses]
+    cleaned_responses = [REMOVE_EXTRA_CHARS_RE_2.sub('', content.translate(SEPARATOR_CHARS_TABLE)).strip().lower() for content in all_responses]
 
     generate_llm_dataset(cleaned_responses, new_csv_path)
-    
-    cleaned_responses = [Counter(i.split()) for i in all_responses]
 
     # Returns dicts of words and their counts in each response
-    return cleaned_responses
\ No newline at end of file
+    return [Counter(content.split()) for content in cleaned_responses]
\ No newline at end of file
@@ -13,41 +13,65 @@ publically availabe by Rachael Tatman on Kaggle
 """
 
 # Imports
-from collections import Counter
-import csv
+from common import dataset_to_counter
+from functools import lru_cache
 from generate_llm_responses import generate_all_responses
+import heapq
+from itertools import islice
 import json
-from langdetect import detect
-import random
+import numpy as np
 from steam_discussion_scraper import combined_scrape
 
 NUM_COMMON_WORDS = 10
 NUM_MOST_ENGLISH_WORDS = 0
+# Number of rows of unigram_freq.csv treated as valid english words
+NUM_VALID_ENGLISH_WORDS = 200000
 
+@lru_cache(maxsize=None)
 def x_most_common_words(x: int):
     """
     Helper function that reads in the x most common words in unigram_freq.csv
     (dataset sourced from https://www.kaggle.com/datasets/rtatman/english-word-frequency)
+    Results are cached since the same x is requested repeatedly.
     """
 
-    data = []
-    with open("unigram_freq.csv", 'r', newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        for i, row in enumerate(reader):
-            if i >= x:
-                break
-            data.append(row[0])
-    return data
+    with open("unigram_freq.csv", 'r') as file:
+        # Skip the "word,count" header
+        next(file)
+        return tuple(line.split(',', 1)[0] for line in islice(file, x))
 
-def dataset_to_list(file_path: str):
+@lru_cache(maxsize=None)
+def english_word_set(num_words: int = NUM_VALID_ENGLISH_WORDS):
     """
-    Helper function to convert a csv with one line of comma-separated words into a list.
+    Helper function that returns the num_words most common words in unigram_freq.csv as a set,
+    used to check whether a word is english.
     """
 
-    with open(file_path, 'r', newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        for row in reader:
-            return row
+    return frozenset(x_most_common_words(num_words))
+
+def _load_and_filter(discussion_csv: str, llm_csv: str):
+    """
+    Helper function that counts the words in discussion_csv and llm_csv, keeping only english
+    words without contractions from discussion_csv. The counts do not depend on how many
+    common english words are excluded, so they can be shared across trials.
+    """
+
+    english_words = english_word_set()
+    discussion_dict = {word: count for word, count in dataset_to_counter(discussion_csv).items() if word in english_words and "'" not in word}
+    llm_dict = dataset_to_counter(llm_csv)
+    return discussion_dict, llm_dict
+
+def _topk_excluding(discussion_dict: dict, llm_dict: dict, x: int, y: int):
+    """
+    Helper function that finds the y most common words in discussion_dict that also appear in
+    llm_dict when the x most common english words are removed.
+    """
+
+    words_to_exclude = set(x_most_common_words(x))
+    # Excluded words are removed from the shared keys rather than the dicts, which are reused across trials
+    common_keys_set = (discussion_dict.keys() & llm_dict.keys()) - words_to_exclude
+    top = heapq.nlargest(y, ((discussion_dict[key], key) for key in common_keys_set))
+    return {key: count for count, key in top}
 
 def make_y_most_common_word_dicts(y: int, x: int, discussion_csv: str, llm_csv: str):
     """
@@ -57,24 +81,8 @@ def make_y_most_common_word_dicts(y: int, x: int, discussion_csv: str, llm_csv:
     words.
     """
 
-    words_to_exclude = set(x_most_common_words(x))
-    discussion_list = dataset_to_list(discussion_csv)
-    llm_list = dataset_to_list(llm_csv)
-    discussion_list = [word for word in discussion_list if word not in words_to_exclude]
-    llm_list = [word for word in llm_list if word not in words_to_exclude]
-    counts = Counter(discussion_list)
-    discussion_dict = Counter({})
-    for word in counts:
-        try:
-            if detect(word) == 'en' and "'" not in word:
-                discussion_dict[word] = counts[word]
-        except:
-            continue
-    counts = Counter(llm_list)
-    discussion_dict = {i: discussion_dict[i] for i in discussion_dict}
-    llm_dict = {i: counts[i] for i in counts}
-    common_keys_set = set(discussion_dict.keys()) & set(llm_dict.keys())
-    return {i[0]: i[1] for i in Counter({key: discussion_dict[key] for key in common_keys_set}).most_common(y)}
+    discussion_dict, llm_dict = _load_and_filter(discussion_csv, llm_csv)
+    return _topk_excluding(discussion_dict, llm_dict, x, y)
 
 def write_all_relevant_data(num_common_word_intervals: int = 500, num_common_word_trials: int = 3, url: str = "https://steamcommunity.com/app/1055540/discussions/0/", game_title: str = "A Short Hike", contents_filename: str = "words.csv", op_filename: str = "op.csv", new_csv_path: str = "llm.csv"):
     """
@@ -86,9 +94,10 @@ def write_all_relevant_data(num_common_word_intervals: int = 500, num_common_wor
     """
     posts = combined_scrape(url, contents_filename, op_filename)
     llm_responses = generate_all_responses(game_title, op_filename, new_csv_path)
+    discussion_dict, llm_dict = _load_and_filter(contents_filename, new_csv_path)
     words_to_check = []
     for i in range(num_common_word_trials):
-        words_to_check.append(make_y_most_common_word_dicts(NUM_COMMON_WORDS, NUM_MOST_ENGLISH_WORDS + (i * num_common_word_intervals), contents_filename, new_csv_path))
+        words_to_check.append(_topk_excluding(discussion_dict, llm_dict, NUM_MOST_ENGLISH_WORDS + (i * num_common_word_intervals), NUM_COMMON_WORDS))
     base_json_path = "dump.json"
     paths = []
     for index, d in enumerate(words_to_check):
@@ -97,53 +106,75 @@ def write_all_relevant_data(num_common_word_intervals: int = 500, num_common_wor
         paths.append(str(index) + base_json_path)
     return paths
 
+def posts_to_matrix(posts: list, words_to_check: list):
+    """
+    Helper function that converts a list of word count dicts into a (number of posts, number of words)
+    matrix where column i holds the counts of words_to_check[i] in each post. Counts are stored as int16 since
+    a word rarely appears more than a few hundred times in a single post.
+    """
+    word_idx = {word: i for i, word in enumerate(words_to_check)}
+    matrix = np.zeros((len(posts), len(words_to_check)), dtype=np.int16)
+    max_count = np.iinfo(np.int16).max
+    for i, post in enumerate(posts):
+        for word, count in post.items():
+            if word in word_idx:
+                if count > max_count:
+                    raise ValueError("Count of " + word + " in a single post is too large to store as int16.")
+                matrix[i, word_idx[word]] = count
+    return matrix
+
 def format_posts(json_path: str):
     """
     Takes the json file produced by write_all_relevant_data, removes any words counted in each post and llm response
-    that aren't included in the most common words and writes to a second json file.
+    that aren't included in the most common words and writes to a second json file. The filtered posts and llm responses
+    are also returned as count matrices (see posts_to_matrix) along with the list of common words so they can be used
+    without reading the second json file back in.
     (Note: json_path should be the same as in write_all_relevant_data)
     """
     dicts = []
     with open(json_path, 'r') as file:
         dicts = json.load(file)
     words_to_check = set(dicts[2].keys())
-    posts = dicts[0]
-    llm_responses = dicts[1]
-    for post in posts:
-        # Convert the keys of the dictionary to a list to avoid RuntimeError during modification
-        keys_to_remove = [key for key in post if key not in words_to_check]
-        for key in keys_to_remove:
-            del post[key]
-    for response in llm_responses:
-        # Convert the keys of the dictionary to a list to avoid RuntimeError during modification
-        keys_to_remove = [key for key in response if key not in words_to_check]
-        for key in keys_to_remove:
-            del response[key]
+    # Intersecting the key views keeps only the common words in a single pass
+    posts = [{key: post[key] for key in post.keys() & words_to_check} for post in dicts[0]]
+    llm_responses = [{key: response[key] for key in response.keys() & words_to_check} for response in dicts[1]]
+    words_to_check = list(words_to_check)
     with open("second_" + json_path, 'w') as file:
-        json.dump([posts, llm_responses, list(words_to_check)], file)
-    
-def calculate_p_value(posts: list, llm_responses: list, word: str):
-    """
-    Calculates the p-value for the for the observed difference in
-    the mean number of times the given word appears across all posts and all llm responses.
-    """
-    post_nums = [post.get(word, 0) for post in posts]
-    llm_response_nums = [response.get(word, 0) for response in llm_responses]
-    n = len(post_nums)
-    m = len(llm_response_nums)
-    observed_diff = abs((sum(post_nums)/n - sum(llm_response_nums)/m))
-    uni_sample = post_nums + llm_response_nums
-    count = 0
+        json.dump([posts, llm_responses, words_to_check], file)
+    return posts_to_matrix(posts, words_to_check), posts_to_matrix(llm_responses, words_to_check), words_to_check
+
+def calculate_p_values_matrix(posts_mat: np.ndarray, llm_responses_mat: np.ndarray):
+    """
+    Calculates the observed differences and p-values for the difference in the mean number of times
+    each word (column) appears across all posts (rows of posts_mat) and all llm responses (rows of
+    llm_responses_mat). Every resample is applied to all words at once.
+    """
+    n = len(posts_mat)
+    m = len(llm_responses_mat)
+    # float32 is plenty of precision for means of small counts and halves the memory traffic of float64
+    uni_sample = np.vstack([posts_mat, llm_responses_mat]).astype(np.float32, copy=False)
+    # Resampled differences are compared against the observed differences in the same float32 precision,
+    # while the reported observed differences are computed in float64 from the counts
+    observed_diffs_32 = np.abs(uni_sample[:n].mean(axis=0) - uni_sample[n:].mean(axis=0))
+    observed_diffs = np.abs(posts_mat.mean(axis=0) - llm_responses_mat.mean(axis=0))
+    rng = np.random.default_rng()
+    counts = np.zeros(uni_sample.shape[1], dtype=np.int64)
 
     for x in range(10000):
-        a_resample = [uni_sample[random.randint(0, len(uni_sample) - 1)] for i in range(n)]
-        b_resample = [uni_sample[random.randint(0, len(uni_sample) - 1)] for i in range(m)]
-        mua = sum(a_resample)/n
-        mub = sum(b_resample)/m
-        dif = abs(mua - mub)
-        if dif >= observed_diff:
-            count += 1
-    return [abs(sum(post_nums)/n - sum(llm_response_nums)/m), float(count / 10000)]
+        # The first n resampled rows form the posts group and the rest form the llm group
+        idx = rng.integers(0, n + m, size=n + m)
+        mua = uni_sample[idx[:n]].mean(axis=0)
+        mub = uni_sample[idx[n:]].mean(axis=0)
+        counts += np.abs(mua - mub) >= observed_diffs_32
+    return observed_diffs, counts / 10000
+
+def calculate_p_value(post_nums: np.ndarray, llm_response_nums: np.ndarray):
+    """
+    Calculates the p-value for the for the observed difference in the mean number of times
+    a word appears across all posts (post_nums) and all llm responses (llm_response_nums).
+    """
+    observed_diffs, p_values = calculate_p_values_matrix(post_nums[:, np.newaxis], llm_response_nums[:, np.newaxis])
+    return [float(observed_diffs[0]), float(p_values[0])]
 
 def calculate_p_values(json_path: str = "dump.json"):
     """
@@ -153,13 +184,16 @@ def calculate_p_values(json_path: str = "dump.json"):
     dicts = []
     with open("second_" + json_path, 'r') as file:
         dicts = json.load(file)
-    posts = dicts[0]
-    llm_responses = dicts[1]
     words_to_check = dicts[2]
-    final_p_values = {}
-    for word in words_to_check:
-        final_p_values[word] = calculate_p_value(posts, llm_responses, word)
-    return final_p_values
+    return calculate_p_values_from_memory(posts_to_matrix(dicts[0], words_to_check), posts_to_matrix(dicts[1], words_to_check), words_to_check)
+
+def calculate_p_values_from_memory(posts_mat: np.ndarray, llm_responses_mat: np.ndarray, words_to_check: list):
+    """
+    Same as calculate_p_values but takes the post and llm response count matrices and common words
+    returned by format_posts directly instead of reading them from the second json file.
+    """
+    observed_diffs, p_values = calculate_p_values_matrix(posts_mat, llm_responses_mat)
+    return {word: [float(observed_diffs[i]), float(p_values[i])] for i, word in enumerate(words_to_check)}
 
 def calculate_p_values_from_scratch():
     """
@@ -168,14 +202,13 @@ def calculate_p_values_from_scratch():
     paths = write_all_relevant_data()
     p_values = []
     for path in paths:
-        format_posts(path)
-        p_values.append(calculate_p_values(path))
+        p_values.append(calculate_p_values_from_memory(*format_posts(path)))
     combined_dict = {}
     for p_value_dict in p_values:
         combined_dict.update(p_value_dict)
     print(combined_dict)
     return combined_dict
 
-if __name__ == "main":
+if __name__ == "__main__":
     # run entire program
     calculate_p_values_from_scratch()
\ No newline at end of file
@@ -8,14 +8,20 @@ Credits: ChatGPT was used for planning and writing elements of the code in this
 """
 
 # Imports
+import aiohttp
+import asyncio
 from bs4 import BeautifulSoup
 from collections import Counter
+from common import write_word_counts
 import csv
 import re
 import requests
 
 REMOVE_EXTRA_CHARS_RE = r'[\[\]\n\r\t?".,\/#!$%^&*;:{}=_`~()\[\]-]+'
 
+# Maximum number of discussion pages requested at the same time
+MAX_CONCURRENT_REQUESTS = 16
+
 def url_to_soup(url: str):
     """
     Helper function to convert url to parsed html content.
@@ -28,7 +34,20 @@ def url_to_soup(url: str):
         ValueError("Response status code must be 200 to scrape page.")
 
     # Parse the HTML content of the page
-    return BeautifulSoup(response.content, 'html.parser')
+    return BeautifulSoup(response.content, 'lxml')
+
+async def fetch_soup(session: aiohttp.ClientSession, url: str):
+    """
+    Helper function to asynchronously convert url to parsed html content using session.
+    Raises aiohttp.ClientResponseError if the page is not returned successfully (e.g. when rate limited).
+    """
+
+    async with session.get(url) as response:
+        response.raise_for_status()
+        content = await response.read()
+
+    # Parse the HTML content of the page
+    return BeautifulSoup(content, 'lxml')
 
 def scrape_for_posts(url: str):
     """
@@ -75,6 +94,18 @@ def scrape_for_content(url: str, filter_non_responsive: bool = True):
     Example url format: https://steamcommunity.com/app/1055540/discussions/0/1639792569850161500/
     """
 
+    async def scrape():
+        async with aiohttp.ClientSession() as session:
+            return await scrape_for_content_async(session, url, filter_non_responsive)
+
+    return asyncio.run(scrape())
+
+async def scrape_for_content_async(session: aiohttp.ClientSession, url: str, filter_non_responsive: bool = True):
+    """
+    Asynchronous version of scrape_for_content that fetches pages with session so that
+    multiple discussion threads can be scraped concurrently.
+    """
+
     # Used to iterate through discussion pages, number indicates page index so it starts at 1
     index = 1
     url += "?ctp=" + str(index)
@@ -93,7 +124,7 @@ def scrape_for_content(url: str, filter_non_responsive: bool = True):
 
     while (still_posts_to_read):
 
-        soup = url_to_soup(url)
+        soup = await fetch_soup(session, url)
 
         # Find all <a> tags and remove them (to remove links that are unnecessary to dataset)
         for a_tag in soup.find_all('a'):
@@ -138,10 +169,22 @@ def scrape_for_content(url: str, filter_non_responsive: bool = True):
     
     return op, contents
 
+async def scrape_all_content(links: list):
+    """
+    Helper function that scrapes every discussion thread in links concurrently, with at most
+    MAX_CONCURRENT_REQUESTS pages being requested at once. Results are in the same order as links.
+    A thread that fails to scrape has its exception returned in place of its result so that it
+    doesn't discard the other threads.
+    """
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await asyncio.gather(*[scrape_for_content_async(session, link) for link in links], return_exceptions=True)
+
 def combined_scrape(url: str, contents_filename: str = "words.csv", op_filename: str = "op.csv"):
     """
     Combines scrape_for_posts and scrape_for_content to scrape all discussion threads and posts for a Steam
-    game's "General Discussions" and writes all reply words found to a csv.
+    game's "General Discussions" and writes the count of every reply word found to a csv.
     Example of a properly formatted URL: https://steamcommunity.com/app/1055540/discussions/0/
     Only the '1055540' portion should be different for a valid url.
     Filename must be a valid csv filename to write correctly.
@@ -151,11 +194,15 @@ def combined_scrape(url: str, contents_filename: str = "words.csv", op_filename:
     links = scrape_for_posts(url)
 
     total_ops = []
-    total_contents = []
+    total_counts = Counter()
     reply_contents = []
 
-    for link in links:
-        op_content, thread_content = scrape_for_content(link)
+    for link, result in zip(links, asyncio.run(scrape_all_content(links))):
+        if isinstance(result, Exception):
+            print("Skipped discussion post that failed to scrape (" + link + "): " + repr(result))
+            continue
+
+        op_content, thread_content = result
         if not op_content or not thread_content:
             continue
 
@@ -164,13 +211,12 @@ def combined_scrape(url: str, contents_filename: str = "words.csv", op_filename:
         # words becomes a list of sublists where each sublist is a comment in a thread
         words = [content.split() for content in thread_content]
         for sublist in words:
-            total_contents += sublist
-            reply_contents.append(Counter(sublist))
+            reply_count = Counter(sublist)
+            total_counts.update(reply_count)
+            reply_contents.append(reply_count)
     
-    # Write the list of comments contents to the CSV file
-    with open(contents_filename, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(total_contents)
+    # Write the count of each word across all comments to the CSV file, one word per row
+    write_word_counts(total_counts, contents_filename)
     
     # Write the list of op contents to the CSV file
     with open(op_filename, mode='w', newline='') as file:
@@ -178,7 +224,7 @@ def combined_scrape(url: str, contents_filename: str = "words.csv", op_filename:
         for op in total_ops:
             writer.writerow(op)
 
-    print(str(len(total_contents)) + " words successfully scraped and writen to " + contents_filename)
+    print(str(sum(total_counts.values())) + " words successfully scraped and writen to " + contents_filename)
 
     # Returns dicts of words and their counts in each post
     return reply_contents
\ No newline at end of file